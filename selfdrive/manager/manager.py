@@ -2,15 +2,16 @@
 import datetime
 import os
 import signal
-import subprocess
 import sys
 import traceback
-from typing import List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
 
 import cereal.messaging as messaging
 import selfdrive.sentry as sentry
 from common.basedir import BASEDIR
 from common.params import Params, ParamKeyType
+from common.realtime import sec_since_boot
 from common.text_window import TextWindow
 from selfdrive.boardd.set_time import set_time
 from system.hardware import HARDWARE, PC
@@ -21,10 +22,89 @@ from selfdrive.sentry import CRASHES_DIR
 from selfdrive.athena.registration import register, UNREGISTERED_DONGLE_ID
 from system.swaglog import cloudlog, add_file_handler
 from system.version import is_dirty, get_commit, get_version, get_origin, get_short_branch, \
-                              terms_version, training_version, is_tested_branch
-
-
-sys.path.append(os.path.join(BASEDIR, "pyextra"))
+                              terms_version, training_version, is_tested_branch, cache
+
+
+_PYEXTRA_DIR = os.path.join(BASEDIR, "pyextra")
+_LOGGERD_DIR = os.path.join(BASEDIR, "selfdrive/loggerd")
+
+if _PYEXTRA_DIR not in sys.path:
+  sys.path.append(_PYEXTRA_DIR)
+
+_DEFAULT_PARAMS: Tuple[Tuple[str, bytes], ...] = (
+  ("AccMadsCombo", b"1"),
+  ("AutoLaneChangeTimer", b"0"),
+  ("BelowSpeedPause", b"0"),
+  ("BrakeLights", b"0"),
+  ("BrightnessControl", b"0"),
+  ("CustomTorqueLateral", b"0"),
+  ("CameraControl", b"2"),
+  ("CameraControlToggle", b"0"),
+  ("CameraOffset", b"0"),
+  ("CarModel", b""),
+  ("CarModelText", b""),
+  ("ChevronInfo", b"1"),
+  ("CustomBootScreen", b"0"),
+  ("CustomOffsets", b"0"),
+  ("CompletedTrainingVersion", b"0"),
+  ("DevUI", b"1"),
+  ("DevUIRow", b"1"),
+  ("DisableOnroadUploads", b"0"),
+  ("DisengageLateralOnBrake", b"1"),
+  ("DisengageOnAccelerator", b"0"),
+  ("DynamicLaneProfile", b"2"),
+  ("DynamicLaneProfileToggle", b"1"),
+  ("EnableMads", b"1"),
+  ("EndToEndLongToggle", b"1"),
+  ("EnhancedScc", b"0"),
+  ("GapAdjustCruise", b"1"),
+  ("GapAdjustCruiseMode", b"0"),
+  ("GapAdjustCruiseTr", b"4"),
+  ("GpxDeleteAfterUpload", b"1"),
+  ("GpxDeleteIfUploaded", b"1"),
+  ("GsmMetered", b"1"),
+  ("HandsOnWheelMonitoring", b"0"),
+  ("HasAcceptedTerms", b"0"),
+  ("LanguageSetting", b"main_en"),
+  ("LastSpeedLimitSignTap", b"0"),
+  ("MadsIconToggle", b"1"),
+  ("MaxTimeOffroad", b"9"),
+  ("OnroadScreenOff", b"0"),
+  ("OnroadScreenOffBrightness", b"50"),
+  ("OpenpilotEnabledToggle", b"1"),
+  ("PathOffset", b"0"),
+  ("ReverseAccChange", b"0"),
+  ("ShowDebugUI", b"1"),
+  ("SpeedLimitControl", b"1"),
+  ("SpeedLimitPercOffset", b"1"),
+  ("SpeedLimitStyle", b"0"),
+  ("SpeedLimitValueOffset", b"0"),
+  ("StandStillTimer", b"0"),
+  ("StockLongToyota", b"0"),
+  ("TorqueDeadzoneDeg", b"0"),
+  ("TorqueFriction", b"1"),
+  ("TorqueMaxLatAccel", b"250"),
+  ("TurnSpeedControl", b"0"),
+  ("TurnVisionControl", b"0"),
+  ("VisionCurveLaneless", b"0"),
+  ("VwAccType", b"0"),
+)
+
+_SHUTDOWN_KEYS = ("DoUninstall", "DoShutdown", "DoReboot")
+_LOGGED_ENV_KEYS = ("DONGLE_ID", "PASSIVE", "NOBOARD", "BLOCK", "PREPAREONLY", "CLEAN")
+
+# managed_processes is built at import and never mutated
+_PROCS = tuple(managed_processes.values())
+_BLOCKED_PROCS = tuple(x for x in os.getenv("BLOCK", "").split(",") if len(x) > 0)
+
+# colored status line entries, indexed by is_alive()
+_PROC_STATUS = {p.name: (f"\u001b[31m{p.name}\u001b[0m", f"\u001b[32m{p.name}\u001b[0m") for p in _PROCS}
+
+
+@cache
+def _get_params() -> Params:
+  # shared by manager_init, manager_thread and main, created on first use
+  return Params()
 
 
 def manager_init() -> None:
@@ -32,75 +112,22 @@ def manager_init() -> None:
   set_time(cloudlog)
 
   # save boot log
-  subprocess.call("./bootlog", cwd=os.path.join(BASEDIR, "selfdrive/loggerd"))
+  pid = os.posix_spawn(os.path.join(_LOGGERD_DIR, "bootlog"), ["bootlog"], os.environ)
+  os.waitpid(pid, 0)
 
-  params = Params()
+  params = _get_params()
   params.clear_all(ParamKeyType.CLEAR_ON_MANAGER_START)
 
-  default_params: List[Tuple[str, Union[str, bytes]]] = [
-    ("AccMadsCombo", "1"),
-    ("AutoLaneChangeTimer", "0"),
-    ("BelowSpeedPause", "0"),
-    ("BrakeLights", "0"),
-    ("BrightnessControl", "0"),
-    ("CustomTorqueLateral", "0"),
-    ("CameraControl", "2"),
-    ("CameraControlToggle", "0"),
-    ("CameraOffset", "0"),
-    ("CarModel", ""),
-    ("CarModelText", ""),
-    ("ChevronInfo", "1"),
-    ("CustomBootScreen", "0"),
-    ("CustomOffsets", "0"),
-    ("CompletedTrainingVersion", "0"),
-    ("DevUI", "1"),
-    ("DevUIRow", "1"),
-    ("DisableOnroadUploads", "0"),
-    ("DisengageLateralOnBrake", "1"),
-    ("DisengageOnAccelerator", "0"),
-    ("DynamicLaneProfile", "2"),
-    ("DynamicLaneProfileToggle", "1"),
-    ("EnableMads", "1"),
-    ("EndToEndLongToggle", "1"),
-    ("EnhancedScc", "0"),
-    ("GapAdjustCruise", "1"),
-    ("GapAdjustCruiseMode", "0"),
-    ("GapAdjustCruiseTr", "4"),
-    ("GpxDeleteAfterUpload", "1"),
-    ("GpxDeleteIfUploaded", "1"),
-    ("GsmMetered", "1"),
-    ("HandsOnWheelMonitoring", "0"),
-    ("HasAcceptedTerms", "0"),
-    ("LanguageSetting", "main_en"),
-    ("LastSpeedLimitSignTap", "0"),
-    ("MadsIconToggle", "1"),
-    ("MaxTimeOffroad", "9"),
-    ("OnroadScreenOff", "0"),
-    ("OnroadScreenOffBrightness", "50"),
-    ("OpenpilotEnabledToggle", "1"),
-    ("PathOffset", "0"),
-    ("ReverseAccChange", "0"),
-    ("ShowDebugUI", "1"),
-    ("SpeedLimitControl", "1"),
-    ("SpeedLimitPercOffset", "1"),
-    ("SpeedLimitStyle", "0"),
-    ("SpeedLimitValueOffset", "0"),
-    ("StandStillTimer", "0"),
-    ("StockLongToyota", "0"),
-    ("TorqueDeadzoneDeg", "0"),
-    ("TorqueFriction", "1"),
-    ("TorqueMaxLatAccel", "250"),
-    ("TurnSpeedControl", "0"),
-    ("TurnVisionControl", "0"),
-    ("VisionCurveLaneless", "0"),
-    ("VwAccType", "0"),
-  ]
+  default_params = _DEFAULT_PARAMS
   if not PC:
-    default_params.append(("LastUpdateTime", datetime.datetime.utcnow().isoformat().encode('utf8')))
+    default_params += (("LastUpdateTime", datetime.datetime.utcnow().isoformat().encode('utf8')),)
 
   if params.get_bool("RecordFrontLock"):
     params.put_bool("RecordFront", True)
 
+  version = get_version()
+  dirty = is_dirty()
+
   # set unset params
   for k, v in default_params:
     if params.get(k) is None:
@@ -122,7 +149,7 @@ def manager_init() -> None:
     print("WARNING: failed to make /dev/shm")
 
   # set version params
-  params.put("Version", get_version())
+  params.put("Version", version)
   params.put("TermsVersion", terms_version)
   params.put("TrainingVersion", training_version)
   params.put("GitCommit", get_commit(default=""))
@@ -139,12 +166,12 @@ def manager_init() -> None:
     raise Exception(f"Registration failed for device {serial}")
   os.environ['DONGLE_ID'] = dongle_id  # Needed for swaglog
 
-  if not is_dirty():
+  if not dirty:
     os.environ['CLEAN'] = '1'
 
   # init logging
   sentry.init(sentry.SentryProject.SELFDRIVE)
-  cloudlog.bind_global(dongle_id=dongle_id, version=get_version(), dirty=is_dirty(),
+  cloudlog.bind_global(dongle_id=dongle_id, version=version, dirty=dirty,
                        device=HARDWARE.get_device_type())
 
   if os.path.isfile(f'{CRASHES_DIR}/error.txt'):
@@ -152,18 +179,20 @@ def manager_init() -> None:
 
 
 def manager_prepare() -> None:
-  for p in managed_processes.values():
+  for p in _PROCS:
     p.prepare()
 
 
 def manager_cleanup() -> None:
   # send signals to kill all procs
-  for p in managed_processes.values():
+  for p in _PROCS:
     p.stop(block=False)
 
-  # ensure all are killed
-  for p in managed_processes.values():
-    p.stop(block=True)
+  # ensure all are killed, waiting on each proc concurrently.
+  # cloudlog bind context is thread-local, so carry ours into the workers
+  ctx = cloudlog.local_ctx().copy()
+  with ThreadPoolExecutor(max_workers=len(_PROCS), initializer=lambda: cloudlog.bind(**ctx)) as executor:
+    list(executor.map(lambda p: p.stop(block=True), _PROCS))
 
   cloudlog.info("everything is dead")
 
@@ -171,45 +200,58 @@ def manager_cleanup() -> None:
 def manager_thread() -> None:
   cloudlog.bind(daemon="manager")
   cloudlog.info("manager start")
-  cloudlog.info({"environ": os.environ})
+  cloudlog.info({"environ": {k: os.environ[k] for k in _LOGGED_ENV_KEYS if k in os.environ}})
 
-  params = Params()
+  params = _get_params()
 
   ignore: List[str] = []
   if params.get("DongleId", encoding='utf8') in (None, UNREGISTERED_DONGLE_ID):
     ignore += ["manage_athenad", "uploader"]
   if os.getenv("NOBOARD") is not None:
     ignore.append("pandad")
-  ignore += [x for x in os.getenv("BLOCK", "").split(",") if len(x) > 0]
+  ignore.extend(_BLOCKED_PROCS)
+  not_run = frozenset(ignore)
 
   sm = messaging.SubMaster(['deviceState', 'carParams'], poll=['deviceState'])
   pm = messaging.PubMaster(['managerState'])
 
-  ensure_running(managed_processes.values(), False, params=params, CP=sm['carParams'], not_run=ignore)
+  ensure_running(_PROCS, False, params=params, CP=sm['carParams'], not_run=not_run)
 
+  # managerState is built once and refilled in place every iteration
+  msg = messaging.new_message('managerState')
+  processes = msg.managerState.init('processes', len(_PROCS))
+  for state, p in zip(processes, _PROCS):
+    state.name = p.name
+
+  last_status: Tuple[Tuple[str, bool], ...] = ()
   while True:
     sm.update()
 
     started = sm['deviceState'].started
-    ensure_running(managed_processes.values(), started, params=params, CP=sm['carParams'], not_run=ignore)
-
-    running = ' '.join("%s%s\u001b[0m" % ("\u001b[32m" if p.proc.is_alive() else "\u001b[31m", p.name)
-                       for p in managed_processes.values() if p.proc)
-    print(running)
-    cloudlog.debug(running)
+    ensure_running(_PROCS, started, params=params, CP=sm['carParams'], not_run=not_run)
 
     # send managerState
-    msg = messaging.new_message('managerState')
-    msg.managerState.processes = [p.get_process_state_msg() for p in managed_processes.values()]
+    msg.logMonoTime = int(sec_since_boot() * 1e9)
+    for state, p in zip(processes, _PROCS):
+      p.get_process_state_msg(state)
     pm.send('managerState', msg)
 
+    # status line reuses the liveness just filled in, only print on change
+    status = tuple((p.name, state.running) for state, p in zip(processes, _PROCS) if p.proc)
+    if status != last_status:
+      running = ' '.join(_PROC_STATUS[name][alive] for name, alive in status)
+      print(running)
+      cloudlog.debug(running)
+      last_status = status
+
     # Exit main loop when uninstall/shutdown/reboot is needed
     shutdown = False
-    for param in ("DoUninstall", "DoShutdown", "DoReboot"):
+    for param in _SHUTDOWN_KEYS:
       if params.get_bool(param):
         shutdown = True
         params.put("LastManagerExitReason", param)
         cloudlog.warning(f"Shutting down manager - {param} set")
+        break
 
     if shutdown:
       break
@@ -240,7 +282,7 @@ def main() -> None:
   finally:
     manager_cleanup()
 
-  params = Params()
+  params = _get_params()
   if params.get_bool("DoUninstall"):
     cloudlog.warning("uninstalling")
     HARDWARE.uninstall()
@@ -4,7 +4,7 @@ import signal
 import struct
 import time
 import subprocess
-from typing import Optional, Callable, List, ValuesView
+from typing import Optional, Callable, FrozenSet, Iterable, List
 from abc import ABC, abstractmethod
 from multiprocessing import Process
 
@@ -172,14 +172,22 @@ class ManagerProcess(ABC):
     cloudlog.info(f"sending signal {sig} to {self.name}")
     os.kill(self.proc.pid, sig)
 
-  def get_process_state_msg(self):
-    state = log.ManagerState.ProcessState.new_message()
-    state.name = self.name
+  def get_process_state_msg(self, state=None):
+    # when filling a reused builder the name is expected to already be set,
+    # rewriting Text fields would grow the message arena on every call
+    if state is None:
+      state = log.ManagerState.ProcessState.new_message()
+      state.name = self.name
     if self.proc:
       state.running = self.proc.is_alive()
       state.shouldBeRunning = self.proc is not None and not self.shutting_down
       state.pid = self.proc.pid or 0
       state.exitCode = self.proc.exitcode or 0
+    else:
+      state.running = False
+      state.shouldBeRunning = False
+      state.pid = 0
+      state.exitCode = 0
     return state
 
 
@@ -289,10 +297,10 @@ class DaemonProcess(ManagerProcess):
     pass
 
 
-def ensure_running(procs: ValuesView[ManagerProcess], started: bool, params=None, CP: car.CarParams=None,
-                   not_run: Optional[List[str]]=None) -> None:
+def ensure_running(procs: Iterable[ManagerProcess], started: bool, params=None, CP: car.CarParams=None,
+                   not_run: Optional[FrozenSet[str]]=None) -> None:
   if not_run is None:
-    not_run = []
+    not_run = frozenset()
 
   for p in procs:
     # Conditions that make a process run